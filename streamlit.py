@@ -1,11 +1,23 @@
 import requests
+from requests.adapters import HTTPAdapter
+import numpy as np
 import pandas as pd
 import streamlit as st
+import cProfile
+import pstats
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timezone
 import os
 import time
 from dotenv import load_dotenv
-import joblib
+import orjson
+
+# ---- Profiling (PROFILE=1 streamlit run streamlit.py) ----
+# The page is network and pandas-reshape bound, not compute bound: the frame
+# is a few thousand rows, and the time goes to the CoinGecko round trip, JSON
+# parsing and the dedup/unstack into tables. Measure with this before
+# optimizing anything else.
+PROFILE = os.getenv("PROFILE") == "1"
 
 # ---- Load API Key ----
 load_dotenv()
@@ -17,6 +29,23 @@ headers = {
     "x-cg-demo-api-key": COINGECKO_API_KEY
 }
 
+# ---- Fetch Config ----
+# /derivatives currently returns everything in one response; raise this if
+# CoinGecko starts paginating it and pages will be fetched concurrently
+DERIVATIVES_PAGES = 1
+FETCH_WORKERS = 4
+
+
+# ---- HTTP Session (shared across reruns so the TLS connection is reused) ----
+@st.cache_resource
+def get_session():
+    session = requests.Session()
+    session.headers.update(headers)
+    session.mount("https://", HTTPAdapter(pool_connections=1,
+                                          pool_maxsize=FETCH_WORKERS))
+    return session
+
+
 # ---- Exchange List ----
 EXCHANGE_LIST = [
     {"id": "binance_futures", "name": "Binance (Futures)"},
@@ -41,167 +70,235 @@ EXCHANGE_LIST = [
     {"id": "lbank-futures", "name": "LBank (Futures)"},
     {"id": "deribit", "name": "Deribit"},
 ]
-ALLOWED_MARKETS = {ex["name"] for ex in EXCHANGE_LIST}
+ALLOWED_MARKETS = frozenset(ex["name"] for ex in EXCHANGE_LIST)
+# Sorted so category codes order the exchange columns alphabetically
+MARKET_DTYPE = pd.CategoricalDtype(
+    categories=sorted(ex["name"] for ex in EXCHANGE_LIST))
+
+# ---- Derivatives Frame Dtypes (shared by fetch and snapshot reads) ----
+DERIVATIVES_DTYPES = {
+    "market": "string[pyarrow]",
+    "symbol": "string[pyarrow]",
+    "token": "string[pyarrow]",
+    # OI is shown to the dollar and funding is compared against exact
+    # thresholds in color_funding, so both keep full precision
+    "open_interest": "float64[pyarrow]",
+    "funding_rate": "float64[pyarrow]",
+    # Only volume is downcast: it is used just for ranking and dedup
+    "volume_24h": "float32[pyarrow]",
+}
 
 # ---- Cache Config ----
-CACHE_FILE = "perps_snapshot.joblib"
+CACHE_FILE = "perps_snapshot.parquet"
 CACHE_TTL = 60 * 60 * 4  # 4 hours
 
 
 # ---- Fetch data from API ----
+def fetch_page(session, page=None):
+    params = {"page": page} if page is not None else None
+    resp = session.get(f"{COINGECKO_URL}/derivatives",
+                       params=params, timeout=60)
+    resp.raise_for_status()
+    return orjson.loads(resp.content)
+
+
 def fetch_data():
+    # Resolve the cached session here; worker threads have no script context
+    session = get_session()
     with st.spinner("Fetching data from Coingecko..."):
-        time.sleep(1)
-    resp = requests.get(f"{COINGECKO_URL}/derivatives",
-                        headers=headers, timeout=60)
-    resp.raise_for_status()
-    data = resp.json()
+        if DERIVATIVES_PAGES > 1:
+            with ThreadPoolExecutor(max_workers=FETCH_WORKERS) as executor:
+                pages = executor.map(lambda page: fetch_page(session, page),
+                                     range(1, DERIVATIVES_PAGES + 1))
+                data = [item for page in pages for item in page]
+        else:
+            data = fetch_page(session)
 
     fetched_at = datetime.now(timezone.utc)
 
-    filtered_data = [
-        {
-            "market": item["market"],
-            "symbol": item["symbol"],
-            "index_id": item["index_id"],
-            "open_interest": item["open_interest"],
-            "funding_rate": item["funding_rate"],
-            "volume_24h": item["volume_24h"],
-            "fetched_at": fetched_at.isoformat()
-        }
-        for item in data if item.get("market") in ALLOWED_MARKETS
-    ]
-    return pd.DataFrame(filtered_data)
-
-
-# ---- Joblib Cache Wrapper ----
+    # Build columns directly instead of a list of per-row dicts
+    cols = {
+        "market": [],
+        "symbol": [],
+        "token": [],
+        "open_interest": [],
+        "funding_rate": [],
+        "volume_24h": [],
+    }
+    is_allowed = ALLOWED_MARKETS.__contains__
+    for item in data:
+        if not is_allowed(item.get("market")):
+            continue
+        cols["market"].append(item["market"])
+        cols["symbol"].append(item["symbol"])
+        cols["token"].append(item["index_id"])  # index_id is the token
+        cols["open_interest"].append(item["open_interest"])
+        cols["funding_rate"].append(item["funding_rate"])
+        cols["volume_24h"].append(item["volume_24h"])
+
+    df = pd.DataFrame(cols).astype(DERIVATIVES_DTYPES)
+    df["fetched_at"] = fetched_at.isoformat()
+    return df
+
+
+# ---- Cache Wrapper (Parquet snapshot, memoized in memory per file) ----
+@st.cache_data(max_entries=1, show_spinner=False)
+def load_snapshot(mtime):
+    # mtime only keys the cache, so a rewritten snapshot is read again
+    # Parquet alone restores StringDtype as string[python], so recast
+    return pd.read_parquet(CACHE_FILE, engine="pyarrow").astype(
+        DERIVATIVES_DTYPES)
+
+
 def get_data():
+    # Snapshot file mtime is the fetch timestamp; checked on every run so
+    # the in-memory copy never outlives the snapshot's TTL
     if os.path.exists(CACHE_FILE):
-        cached = joblib.load(CACHE_FILE)
-        last_fetch = cached.get("fetched_at")
-        if last_fetch:
-            elapsed = (datetime.now(timezone.utc) - last_fetch).total_seconds()
-            if elapsed < CACHE_TTL:
-                return cached["data"]
+        mtime = os.path.getmtime(CACHE_FILE)
+        if time.time() - mtime < CACHE_TTL:
+            return load_snapshot(mtime)
 
     # Fetch fresh if no cache or cache expired
     df = fetch_data()
-    joblib.dump(
-        {"data": df, "fetched_at": datetime.now(timezone.utc)}, CACHE_FILE)
+    df.to_parquet(CACHE_FILE, engine="pyarrow", compression="zstd")
     return df
 
 
-# ---- Streamlit Page Setup ----
-st.set_page_config(page_title="Perps Snapshot", layout="wide")
-st.title("📊 Perpetuals Snapshot Dashboard")
-st.info('Data from Coingecko', icon="ℹ️")
-
-# ---- Fetch data (cached with joblib) ----
-df_db = get_data()
-
-# ---- Use index_id as token ----
-df_db["token"] = df_db["index_id"]
-
-# ---- Highest-volume contract per token & exchange ----
-df_best = (
-    df_db.sort_values(["token", "market", "volume_24h"],
-                      ascending=[True, True, False])
-    .groupby(["token", "market"], as_index=False)
-    .first()
-)
-
-# ---- Sidebar ----
-with st.sidebar:
-    st.header("ℹ️ About Funding Rates")
-    st.markdown("""
-    Funding rates are periodic payments exchanged between long and short positions in perpetual futures.  
-    - **Positive funding**: Longs pay shorts → Bearish sentiment.  
-    - **Negative funding**: Shorts pay longs → Bullish sentiment.  
-    - **Near zero funding**: Neutral sentiment.  
-    ---
-    **Legend:**  
-    - **Green**: Bullish (Funding < 0.005%)  
-    - **White**: Neutral (Funding ≈ 0.01%)  
-    - **Red**: Bearish (Funding > 0.01%)  
-    """, unsafe_allow_html=True)
-
-    # ---- Footer ----
-    st.markdown("---")
-    st.markdown(
-        "🔨 Built by [@Daddy Brian](https://x.com/seniormanfm) "
-        "and [@Daniel Amah](https://x.com/danny_4reel)",
-        unsafe_allow_html=True,
+# ---- Build Funding & Open Interest Tables (cached per snapshot) ----
+@st.cache_data(ttl=CACHE_TTL, show_spinner=False)
+def build_tables(df_db):
+    # Categorical keys for groupby/unstack
+    df_db = df_db.assign(
+        token=df_db["token"].astype("category"),
+        market=df_db["market"].astype(MARKET_DTYPE),
     )
 
+    # Highest-volume contract per token & exchange
+    df_best = (
+        df_db.sort_values("volume_24h", ascending=False, kind="stable")
+        .drop_duplicates(subset=["token", "market"], keep="first")
+    )
 
-# ---- Funding Table ----
-funding_table = df_best.pivot_table(
-    index="token",
-    columns="market",
-    values="funding_rate",
-    aggfunc="first"
-).reset_index()
-
-# ---- Open Interest Table ----
-oi_table = df_best.pivot_table(
-    index="token",
-    columns="market",
-    values="open_interest",
-    aggfunc="first"
-).reset_index()
-
-# ---- Limit to Top 100 tokens ----
-top_tokens = (
-    df_best.groupby("token")["volume_24h"]
-    .sum()
-    .sort_values(ascending=False)
-    .head(100)
-    .index
-)
-funding_table = funding_table[funding_table["token"].isin(top_tokens)]
-oi_table = oi_table[oi_table["token"].isin(top_tokens)]
-
-# ---- Format Funding Table ----
-for col in funding_table.columns[1:]:
-    funding_table[col] = funding_table[col].apply(
-        lambda x: f"{x:.4f}%" if pd.notnull(x) else "-"
+    # Limit to Top 100 tokens (before reshaping)
+    top_tokens = (
+        df_best.groupby("token", observed=True)["volume_24h"]
+        .sum()
+        .nlargest(100)
+        .index
     )
+    df_best = df_best[df_best["token"].isin(top_tokens)]
 
+    # df_best is unique per (token, market), so an unstack replaces the
+    # pivot_table aggregation
+    value_cols = ["funding_rate", "open_interest"]
+    wide = (
+        df_best.set_index(["token", "market"])[value_cols]
+        .unstack("market")
+        # tokens already come out sorted (defensive), but exchange columns
+        # follow first appearance in the volume-sorted frame, so sort them
+        # by MARKET_DTYPE's alphabetical categories
+        .sort_index()
+        .sort_index(axis=1)
+    )
+    # mirror pivot_table's dropna=True: drop all-null tokens and exchanges
+    # per table, so funding and OI may list different exchanges
+    funding_table = (
+        wide["funding_rate"]
+        .dropna(how="all")
+        .dropna(axis=1, how="all")
+        .reset_index()
+    )
+    oi_table = (
+        wide["open_interest"]
+        .dropna(how="all")
+        .dropna(axis=1, how="all")
+        .reset_index()
+    )
+    return funding_table, oi_table
 
-def color_funding(val):
-    if val == "-":
-        return ""
-    try:
-        num = float(val.strip('%'))
-    except Exception:
-        return ""
-    if num < 0.005:
-        return "color: green;"   # Bullish
-    elif num > 0.01:
-        return "color: red;"     # Bearish
-    else:
-        return "color: white;"   # Neutral
-
-
-styled_funding_table = funding_table.style.applymap(
-    color_funding, subset=funding_table.columns[1:]
-)
-
-# ---- Format Open Interest Table ----
-for col in oi_table.columns[1:]:
-    oi_table[col] = oi_table[col].apply(
-        lambda x: f"${x:,.0f}" if pd.notnull(x) else "-"
+
+# ---- Funding Table Styling ----
+def color_funding(col):
+    num = col.to_numpy(dtype="float64", na_value=np.nan)
+    return np.where(
+        np.isnan(num), "",
+        np.where(num < 0.005, "color: green;",      # Bullish
+                 np.where(num > 0.01, "color: red;",  # Bearish
+                          "color: white;"))          # Neutral
     )
 
-# ---- Tabs ----
-tab1, tab2 = st.tabs(["📈 Funding Rates", "💰 Open Interest"])
 
-with tab1:
-    st.subheader("Funding Rates (Top 100 Most Traded Tokens)")
-    st.dataframe(styled_funding_table, use_container_width=True,
-                 height=800, hide_index=True)
+# ---- Page ----
+def render_page():
+    # ---- Streamlit Page Setup ----
+    st.set_page_config(page_title="Perps Snapshot", layout="wide")
+    st.title("📊 Perpetuals Snapshot Dashboard")
+    st.info('Data from Coingecko', icon="ℹ️")
 
-with tab2:
-    st.subheader("Open Interest (Top 100 Most Traded Tokens)")
-    st.dataframe(oi_table, use_container_width=True,
-                 height=800, hide_index=True)
+    # ---- Fetch data (cached in memory, backed by Parquet snapshot) ----
+    df_db = get_data()
+    funding_table, oi_table = build_tables(df_db)
+
+    # ---- Sidebar ----
+    with st.sidebar:
+        st.header("ℹ️ About Funding Rates")
+        st.markdown("""
+        Funding rates are periodic payments exchanged between long and short positions in perpetual futures.  
+        - **Positive funding**: Longs pay shorts → Bearish sentiment.  
+        - **Negative funding**: Shorts pay longs → Bullish sentiment.  
+        - **Near zero funding**: Neutral sentiment.  
+        ---
+        **Legend:**  
+        - **Green**: Bullish (Funding < 0.005%)  
+        - **White**: Neutral (Funding ≈ 0.01%)  
+        - **Red**: Bearish (Funding > 0.01%)  
+        """, unsafe_allow_html=True)
+
+        # ---- Footer ----
+        st.markdown("---")
+        st.markdown(
+            "🔨 Built by [@Daddy Brian](https://x.com/seniormanfm) "
+            "and [@Daniel Amah](https://x.com/danny_4reel)",
+            unsafe_allow_html=True,
+        )
+
+    # ---- Format Tables (values stay numeric, formatted at render time) ----
+    styled_funding_table = funding_table.style.format(
+        {col: "{:.4f}%" for col in funding_table.columns[1:]}, na_rep="-"
+    ).apply(
+        color_funding, subset=funding_table.columns[1:]
+    )
+
+    styled_oi_table = oi_table.style.format(
+        {col: "${:,.0f}" for col in oi_table.columns[1:]}, na_rep="-"
+    )
+
+    # ---- Tabs ----
+    tab1, tab2 = st.tabs(["📈 Funding Rates", "💰 Open Interest"])
+
+    with tab1:
+        st.subheader("Funding Rates (Top 100 Most Traded Tokens)")
+        st.dataframe(styled_funding_table, use_container_width=True,
+                     height=800, hide_index=True)
+
+    with tab2:
+        st.subheader("Open Interest (Top 100 Most Traded Tokens)")
+        st.dataframe(styled_oi_table, use_container_width=True,
+                     height=800, hide_index=True)
+
+
+# ---- Run Page (PROFILE=1 prints a report even if the run stops early) ----
+profiler = None
+if PROFILE:
+    profiler = cProfile.Profile()
+    try:
+        profiler.enable()
+    except ValueError:
+        # Python 3.12+: another session's run is already being profiled
+        profiler = None
+try:
+    render_page()
+finally:
+    if profiler is not None:
+        profiler.disable()
+        pstats.Stats(profiler).sort_stats("cumulative").print_stats(10)